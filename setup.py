@@ -62,9 +62,8 @@ from setuptools import setup
 version = '0.3.3'
 
 install_requires=[
-    'six',
     'debug_tools',
-    'PyGithub',
+    'PyGithub>=2.6',
 ]
 
 setup \
@@ -37,60 +37,101 @@
 #
 
 import os
-import io
 import re
 import json
 import time
+import signal
+import threading
+import itertools
 
 import github
+import github.Repository
 import requests
 import argparse
 import contextlib
+import configparser
+import concurrent.futures
 
 try:
-    import configparser
+    import fcntl
 
-except( ImportError, ValueError ):
-    from six.moves import configparser
+except ImportError:
+    fcntl = None
+    import msvcrt
 
 from collections import OrderedDict
+from urllib3.util.retry import Retry
 
 from debug_tools import getLogger
 from debug_tools.utilities import wrap_text
-from debug_tools.utilities import pop_dict_last_item
-from debug_tools.utilities import move_to_dict_beginning
-from debug_tools.third_part import get_section_option
 from debug_tools.estimated_time_left import sequence_timer
 from debug_tools.estimated_time_left import progress_info
 
 PACKAGE_ROOT_DIRECTORY = os.path.dirname( os.path.realpath( __file__ ) )
 CHANNEL_SESSION_FILE = os.path.join( PACKAGE_ROOT_DIRECTORY, "last_session.json" )
+ETAGS_CACHE_FILE = os.path.join( PACKAGE_ROOT_DIRECTORY, "etags_cache.json" )
+PARSED_FILES_CACHE_FILE = os.path.join( PACKAGE_ROOT_DIRECTORY, "parsed_files_cache.json" )
+LOCK_FILE = os.path.join( PACKAGE_ROOT_DIRECTORY, "githubpullrequests.lock" )
 
 headers = {}
+
 MAXIMUM_WORSPACES_ENTRIES = 100
+MAXIMUM_ETAGS_ENTRIES = 5000
+MAXIMUM_ETAGS_RESPONSE_SIZE = 65536
+DEFAULT_CONCURRENCY = 8
+READ_BUFFER_SIZE = 131072
+WRITE_BUFFER_SIZE = 65536
+MAXIMUM_TOKEN_FILE_SIZE = 4096
+MINIMUM_RATE_LIMIT_REMAINING = 100
+SESSION_SAVE_FREQUENCY = 25
+
+# Keep alive the connection to the GitHub GraphQL API across all queries, then, retry the
+# transient gateway errors instead of aborting the whole report
+graphql_session = requests.Session()
+graphql_session.mount( "https://", requests.adapters.HTTPAdapter(
+        pool_connections=1, pool_maxsize=DEFAULT_CONCURRENCY,
+        max_retries=Retry( total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504], allowed_methods=None ) ) )
+
+BRANCHES_REGEX = re.compile( r'(.+)->(.+),' )
+GITHUB_URL_REGEX = re.compile( r'github\.com/([^/]+)/([^/\s]+?)(?:\.git)?(?:[/\s]|$)' )
+
+PULL_REQUEST_BODY = wrap_text( r"""
+    The upstream repository `{}` has some new changes that aren't in this fork.
+    So, here they are, ready to be merged!
+
+    This Pull Request was created programmatically by the
+    [githubpullrequests](https://github.com/evandrocoan/githubpullrequests).
+""", single_lines=True )
 
 g_is_already_running = False
 log = getLogger( 127, "" )
 
 
 def main():
-    github_token = os.environ.get( 'GITHUBPULLREQUESTS_TOKEN', "" ).strip()
-
     # https://stackoverflow.com/questions/6382804/how-to-use-getopt-optarg-in-python-how-to-shift
     argumentParser = argparse.ArgumentParser( description='Create Pull Requests, using GitHub API and a list of repositories.' )
 
     argumentParser.add_argument( "-f", "--file", action="append", default=[],
             help="The file with the repositories informations" )
 
-    argumentParser.add_argument( "-t", "--token", action="store", default="",
+    # The `append` action appends to its default list, then, the environment variable default is
+    # not the argparse default, otherwise, it would be used together with the passed tokens
+    argumentParser.add_argument( "-t", "--token", action="append", default=None,
             help="GitHub token with `public_repos` access, or the path "
             "to a file with the Github token in plain text. The only contents "
-            "the file can have is the token, optionally with a trailing new line." )
+            "the file can have is the token, optionally with a trailing new line. "
+            "It can be passed several times, then, the threads use the tokens in turns. "
+            "Defaults to the `GITHUBPULLREQUESTS_TOKEN` environment variable." )
 
     argumentParser.add_argument( "-mr", "--maximum-repositories", action="store", type=int, default=0,
             metavar="number",
             help="The maximum count of repositories/requests to process per file." )
 
+    argumentParser.add_argument( "-cc", "--concurrency", action="store", type=int, default=DEFAULT_CONCURRENCY,
+            metavar="number",
+            help="How many repositories/requests to process at the same time. "
+            "Keep it low to stay well under the GitHub secondary rate limits." )
+
     argumentParser.add_argument( "-c", "--cancel-operation", action="store_true", default=False,
             help="If there is some batch operation running, cancel it as soons as possible." )
 
@@ -120,17 +161,12 @@ def main():
         free_mutex_lock()
         return
 
-    if argumentsNamespace.token:
-        github_token = argumentsNamespace.token
+    github_tokens = argumentsNamespace.token or [os.environ.get( 'GITHUBPULLREQUESTS_TOKEN', "" )]
+    github_tokens = [github_token for github_token in map( read_github_token, github_tokens ) if github_token]
 
-    if github_token:
+    if github_tokens:
         global headers
-        if os.path.exists( github_token ):
-            with open( github_token, 'r', ) as input_file:
-                github_token = input_file.read()
-
-        github_token = github_token.strip()
-        headers = { "Authorization": f"Bearer {github_token}" }
+        headers = { "Authorization": f"Bearer {github_tokens[0]}" }
         log_ratelimit(headers)
 
     else:
@@ -149,10 +185,11 @@ def main():
 
     if argumentsNamespace.file:
         pull_requester = PullRequester(
-            github_token,
+            github_tokens,
             argumentsNamespace.maximum_repositories,
             argumentsNamespace.synced_repositories,
-            argumentsNamespace.dry_run
+            argumentsNamespace.dry_run,
+            argumentsNamespace.concurrency,
         )
         pull_requester.parse_gitmodules( argumentsNamespace.file )
         pull_requester.publish_report()
@@ -162,32 +199,46 @@ def main():
 
 class PullRequester(object):
 
-    def __init__(self, github_token, maximum_repositories=0, synced_repositories=False, is_dry_run=False):
+    def __init__(self, github_token, maximum_repositories=0, synced_repositories=False, is_dry_run=False,
+            concurrency=DEFAULT_CONCURRENCY):
+        """
+            The `github_token` is either one token or a list of tokens. With several tokens, each
+            thread uses the next one, then, their rate limits add up.
+        """
         super(PullRequester, self).__init__()
         self.is_dry_run = is_dry_run
-        self.github_token = github_token
+        self.github_tokens = [github_token] if isinstance( github_token, str ) else list( github_token )
+        self.github_token = self.github_tokens[0]
+        self.concurrency = max( 1, concurrency )
 
         if synced_repositories:
             self.lastSection = OrderedDict()
 
         else:
-            try:
-                with open( CHANNEL_SESSION_FILE, 'r' ) as data_file:
-                    self.lastSection = json.load( data_file, object_pairs_hook=OrderedDict )
+            self.lastSection = load_data_file( CHANNEL_SESSION_FILE )
 
-            except( IOError, ValueError ):
-                self.lastSection = OrderedDict()
+        self.parsed_files = load_data_file( PARSED_FILES_CACHE_FILE )
+        self.parsed_files_lock = threading.Lock()
 
         self.maximum_repositories = maximum_repositories
         self.synced_repositories = synced_repositories
 
-        self.last_module_file = None
-        self.request_index = 0
+        self.sections_futures = []
         self.skipped_repositories = []
+
+        # The sections are processed by several threads, but the pull requests are created one by one
+        self.create_pull_lock = threading.Lock()
+
+        self.thread_data = threading.local()
+        self.tokens_lock = threading.Lock()
+        self.tokens_cycle = itertools.cycle( self.github_tokens )
+        self.etags_cache = ETagsCache()
+
+        self.graphql_headers = { "Authorization": f"Bearer {self.github_token}" }
         self.init_report()
 
     def init_report(self):
-        self.repositories_results = OrderedDict()
+        self.repositories_results = {}
         self.skip_reasons = [
             'No commits between',
             'A pull request already exists',
@@ -195,24 +246,45 @@ class PullRequester(object):
             'has no history in common',
         ]
 
+        # The reasons are literal strings, then, the matched text is the reason itself
+        self.skip_reasons_regex = re.compile( "|".join( re.escape( reason ) for reason in self.skip_reasons ) )
+
         for reason in self.skip_reasons:
             self.repositories_results[reason] = []
 
         self.downstream_users = set()
         self.parsed_repositories = set()
-        self.full_parsed_repositories = {}
 
+        self.repositories_results['Invalid Section'] = []
+        self.repositories_results['Repository not found'] = []
         self.repositories_results['Unknown Reason'] = []
         self.repositories_results['Successfully Created'] = []
 
-        # using username and password
-        # self.github_api = github.Github("user", "password")
+    @property
+    def github_api(self):
+        """
+            The PyGithub connections are not thread safe, then, each thread creates its own client.
+            https://github.com/PyGithub/PyGithub/issues/1255
+        """
+        github_api = getattr( self.thread_data, 'github_api', None )
+
+        if github_api is None:
+            # using username and password
+            # github_api = github.Github("user", "password")
+
+            with self.tokens_lock:
+                github_token = next( self.tokens_cycle )
 
-        # or using an access token
-        self.github_api = github.Github( self.github_token )
+            # or using an access token
+            github_api = self.thread_data.github_api = github.Github( auth=github.Auth.Token( github_token ),
+                    per_page=100, retry=github.GithubRetry( total=3 ) )
+            self.etags_cache.install( github_api.requester )
+            raise_on_redirects( github_api.requester )
 
-        # Github Enterprise with custom hostname
-        # self.github_api = github.Github(base_url="https://{hostname}/api/v3", login_or_token="access_token")
+            # Github Enterprise with custom hostname
+            # github_api = github.Github(base_url="https://{hostname}/api/v3", login_or_token="access_token")
+
+        return github_api
 
     def parse_gitmodules(self, gitmodules_file):
 
@@ -223,275 +295,567 @@ class PullRequester(object):
                 if not isinstance( gitmodules_file, list ):
                     raise ValueError( "The gitmodules_file need to be an instance of list: `%s`" % gitmodules_file )
 
-                self._parse_gitmodules( gitmodules_file )
+                with exit_on_sigterm():
+                    self._parse_gitmodules( gitmodules_file )
 
             except:
-                self._save_data( self.request_index - 1 )
+                self._save_data( gitmodules_file, is_finished=False )
+                self.etags_cache.save()
                 raise
 
-            self._save_data( 0, gitmodules_file )
+            self._save_data( gitmodules_file, is_finished=True )
+            self.etags_cache.save()
 
-        free_mutex_lock()
+    def _save_data(self, gitmodules_file, is_finished):
 
-    def _save_data(self, index, gitmodules_file):
-        if not self.last_module_file: return
+        # On finish, the indexes are reset even when nothing was submitted, e.g., an index saved
+        # past the end of its file, otherwise, it would skip the whole file forever
+        if not is_finished and not self.sections_futures: return
+        resume_indexes = dict.fromkeys( gitmodules_file, 0 )
 
-        if index:
-            self._save_data2(index, self.last_module_file)
-        else:
-            for filename in gitmodules_file:
-                self._save_data2(0, filename)
+        if not is_finished:
+            resume_indexes = { filename: self.lastSection.get( filename, 0 ) for filename in gitmodules_file }
+
+            # The fully finished files resume from their end, instead of running all over again
+            for future, module_file, section_index in self.sections_futures:
+                resume_indexes[module_file] = section_index + 1
+
+            # The sections run concurrently, then, resume from the first section not finished on each file.
+            # The sections finished after it run again, as many as the other threads finished meanwhile
+            for future, module_file, section_index in reversed( self.sections_futures ):
+                if not future.done() or future.cancelled() or future.exception():
+                    resume_indexes[module_file] = section_index
+
+        for filename, index in resume_indexes.items():
+            self._save_data2( index, filename )
+
+        save_data_file( CHANNEL_SESSION_FILE, self.lastSection, indent=4, separators=(',', ': ') )
 
     def _save_data2(self, index, file_name):
         self.lastSection[file_name] = index
-        move_to_dict_beginning( self.lastSection, file_name )
+        self.lastSection.move_to_end( file_name, last=False )
 
         while len( self.lastSection ) > MAXIMUM_WORSPACES_ENTRIES:
-            pop_dict_last_item( self.lastSection )
-
-        with open( CHANNEL_SESSION_FILE, 'w' ) as output_file:
-            json.dump( self.lastSection, output_file, indent=4, separators=(',', ': ') )
+            self.lastSection.popitem( last=True )
 
     def _parse_gitmodules(self, gitmodules_file):
-        sections_count = 0
-        loaded_config_file = OrderedDict()
-
-        for module_file in gitmodules_file:
-            # https://stackoverflow.com/questions/45415684/how-to-stop-tabs-on-python-2-7-rawconfigparser-throwing-parsingerror/
-            with open( module_file ) as fakeFile:
-                # https://stackoverflow.com/questions/22316333/how-can-i-resolve-typeerror-with-stringio-in-python-2-7
-                fakefile = io.StringIO( fakeFile.read().replace( u"\t", u"" ) )
-
-            config_parser = configparser.RawConfigParser()
-            config_parser._read( fakefile, module_file )
-            sections_count += len( config_parser.sections() )
-            loaded_config_file[module_file] = config_parser
-
-        start_index = 0
-        self.request_index = 0
-        successful_resquests = 0
+        sections = []
 
-        def get_sections():
-            for module_file, config_parser in loaded_config_file.items():
-                for section in config_parser.sections():
-                    yield section, module_file, config_parser
+        # The module files can be on slow disks, then, they are read and parsed concurrently
+        with concurrent.futures.ThreadPoolExecutor( max_workers=self.concurrency ) as executor:
+            loaded_config_file = dict( zip( gitmodules_file, executor.map( self._load_sections, gitmodules_file ) ) )
 
-        self.last_module_file = ""
+        self._save_parsed_files()
 
-        for sections, pi in sequence_timer( get_sections(), info_frequency=0, length=sections_count ):
-            section, module_file, config_parser = sections
-            progress = progress_info( pi )
-            self.request_index += 1
-            self.request_index = self.request_index
+        for module_file, module_sections in loaded_config_file.items():
 
-            if self.last_module_file != module_file:
-                self.last_module_file = module_file
-                start_index = self.lastSection.get( module_file, 0 )
+            # Resume from the last processed index, without walking through the sections before it
+            start_index = self.lastSection.get( module_file, 0 )
 
-                log.newline(count=2)
-                log( 1, 'module_file', module_file )
+            sections.extend( ( section, section_index, module_file )
+                    for section_index, section in enumerate( module_sections[start_index:], start=start_index ) )
 
-            if not g_is_already_running:
-                raise ImportError( "Stopping the process as this Python module was reloaded!" )
+        # For quick testing
+        if self.maximum_repositories:
+            sections = sections[:self.maximum_repositories]
 
-            # Walk until the last processed index, skipping everything else
-            if start_index > 0:
-                start_index -= 1
-                continue
+        request_index = 0
+        successful_resquests = 0
 
-            # For quick testing
-            if self.maximum_repositories and self.request_index > self.maximum_repositories:
-                break
+        unique_futures = {}
+        duplicated_sections = {}
 
-            log.newline()
-            log( 1, "{:s}, {:3d}({:d}) of {:d}...".format(
-                    progress, self.request_index, successful_resquests, sections_count ) )
+        with concurrent.futures.ThreadPoolExecutor( max_workers=self.concurrency ) as executor:
+            self.sections_futures = []
 
-            downstream = get_section_option( section, "url", config_parser )
-            upstream = get_section_option( section, "upstream", config_parser )
+            # Several files can list the same pull request, then, it is created only once and the
+            # other sections share its result
+            for section, section_index, module_file in sections:
+                section_key = get_section_key( *section[1:] )
+                future = unique_futures.get( section_key )
 
-            upstream_user, upstream_repository = parse_github( upstream )
-            downstream_user, downstream_repository = parse_github( downstream )
-            downstream_name = "{}/{}".format( downstream_user, downstream_repository )
+                # The names are case insensitive, then, each section keeps its own case on the report
+                downstream_user, downstream_repository = parse_github( section[1] )
+                downstream_name = f"{downstream_user}/{downstream_repository}"
+                section_names = ( downstream_user, downstream_name, f"{downstream_name} -> {section[0]}" )
 
-            branches = get_section_option( section, "branches", config_parser )
-            local_branch, upstream_branch = parser_branches( branches )
+                if future is None:
+                    future = executor.submit( self._process_section, module_file, *section )
+                    if all( section_key ): unique_futures[section_key] = future
 
-            full_upstream_name = "{}/{}@{}".format( upstream_user, upstream_repository, upstream_branch )
-            full_downstream_name = "{} -> {}".format( downstream_name, section )
+                else:
+                    duplicated_sections.setdefault( future, [] ).append( section_names )
+
+                self.sections_futures.append( ( future, module_file, section_index ) )
 
-            log( 1, branches )
-            log( 1, 'upstream', full_upstream_name )
-            log( 1, 'downstream', full_downstream_name )
+            submitted_futures = set( future for future, _, _ in self.sections_futures )
+            sections_count = len( submitted_futures )
 
-            if not downstream_user or not downstream_repository:
-                log.newline( count=3 )
-                log( 1, "ERROR! Invalid downstream `%s`", downstream )
+            if duplicated_sections:
+                log( 1, 'Skipping %s duplicated sections', len( sections ) - sections_count )
 
             try:
-                fork_user = self.github_api.get_user( downstream_user )
-                fork_repo = fork_user.get_repo( downstream_repository )
+                completed_futures = concurrent.futures.as_completed( submitted_futures )
 
-            except github.GithubException as error:
-                self._register_error_reason( full_downstream_name, error )
-                continue
+                for future, pi in sequence_timer( completed_futures, info_frequency=0, length=sections_count ):
+                    request_index += 1
+                    downstream_user, downstream_name, report_key, full_downstream_name, error_details = future.result()
+                    successful_resquests += self._register_result( downstream_user, downstream_name, report_key,
+                            full_downstream_name + error_details )
 
-            self.downstream_users.add( downstream_user )
-            self.parsed_repositories.add( downstream_name )
-            self.full_parsed_repositories[downstream_name] = fork_repo
+                    # The duplicated sections share the result and its error details, e.g., `, 500 {...}`
+                    for duplicated_user, duplicated_name, duplicated_full_name in duplicated_sections.get( future, [] ):
+                        self._register_result( duplicated_user, duplicated_name, report_key,
+                                duplicated_full_name + error_details )
 
-            if not upstream_user or not upstream_repository:
-                log( 1, "Skipping %s because the upstream is not defined...", section )
-                self.skipped_repositories.append( "%s -> %s" % ( downstream_name, section ) )
-                continue
+                    log( 1, "{:s}, {:3d}({:d}) of {:d}...".format(
+                            progress_info( pi ), request_index, successful_resquests, sections_count ) )
 
-            if not local_branch or not upstream_branch:
-                log.newline( count=3 )
-                log( 1, "ERROR! Invalid branches `%s`", branches )
+                    # Save the progress from time to time, then, a killed process can still resume
+                    if request_index % SESSION_SAVE_FREQUENCY == 0:
+                        self._save_data( gitmodules_file, is_finished=False )
 
-            try:
-                if self.is_dry_run:
-                    fork_pullrequest = fork_repo.url
+            except:
+                for future, _, _ in self.sections_futures:
+                    future.cancel()
 
-                else:
-                    fork_pullrequest = fork_repo.create_pull(
-                            "Update from {}".format( full_upstream_name ),
-                            wrap_text( r"""
-                                The upstream repository `{}` has some new changes that aren't in this fork.
-                                So, here they are, ready to be merged!
-
-                                This Pull Request was created programmatically by the
-                                [githubpullrequests](https://github.com/evandrocoan/githubpullrequests).
-                            """.format( full_upstream_name ), single_lines=True, ),
-                            local_branch,
-                            '{}:{}'.format( upstream_user, upstream_branch ),
-                            False
-                        )
+                # The executor exit waits for the running sections, which can take minutes, then, the
+                # session is saved before it, as a SIGKILL can follow the SIGTERM
+                self._save_data( gitmodules_file, is_finished=False )
+                raise
+
+    def _load_sections(self, module_file):
+        """
+            Return a list with the `[section, url, upstream, branches]` of the `module_file`.
+
+            The sections are cached by the file modification time and size, skipping the
+            parsing of files which did not change since the last run.
+        """
+        file_path = os.path.abspath( module_file )
+        file_stat = os.stat( file_path )
+
+        file_version = [file_stat.st_mtime_ns, file_stat.st_size]
+        parsed_file = self.parsed_files.get( file_path )
+
+        if parsed_file and parsed_file[0] == file_version:
+            return parsed_file[1]
+
+        # A duplicated section or option keeps its last value, instead of aborting the whole file
+        config_parser = configparser.ConfigParser( strict=False, interpolation=None )
+        config_parser.read_file( read_without_tabs( module_file ), source=module_file )
+
+        sections = []
+
+        for section in config_parser.sections():
+            options = dict( config_parser.items( section ) )
+
+            sections.append( [
+                section,
+                options.get( "url", "" ),
+                options.get( "upstream", "" ),
+                options.get( "branches", "" ),
+            ] )
+
+        with self.parsed_files_lock:
+            self.parsed_files[file_path] = [file_version, sections]
+            self.parsed_files.move_to_end( file_path, last=False )
+
+        return sections
+
+    def _save_parsed_files(self):
+
+        while len( self.parsed_files ) > MAXIMUM_WORSPACES_ENTRIES:
+            self.parsed_files.popitem( last=True )
+
+        save_data_file( PARSED_FILES_CACHE_FILE, self.parsed_files )
+
+    def _process_section(self, module_file, section, downstream, upstream, branches):
+        """
+            Create the pull request for one section of the `module_file`.
+
+            It runs on the `concurrency` thread pool, then, instead of changing the shared state,
+            it returns the `(downstream_user, downstream_name, report_key, full_downstream_name,
+            error_details)` to be registered by the main thread. The `downstream_name` is empty for
+            invalid sections, and the `error_details` is empty unless the error reason is unknown.
+        """
+
+        if not g_is_already_running:
+            raise ImportError( "Stopping the process as this Python module was reloaded!" )
+
+        upstream_user, upstream_repository = parse_github( upstream )
+        downstream_user, downstream_repository = parse_github( downstream )
+        downstream_name = f"{downstream_user}/{downstream_repository}"
+
+        local_branch, upstream_branch = parser_branches( branches )
+
+        full_upstream_name = f"{upstream_user}/{upstream_repository}@{upstream_branch}"
+        full_downstream_name = f"{downstream_name} -> {section}"
+
+        log( 1, '%s, %s, upstream %s, downstream %s', module_file, branches, full_upstream_name, full_downstream_name )
+
+        if not downstream_user or not downstream_repository:
+            log.newline( count=3 )
+            log( 1, "ERROR! Invalid downstream `%s`", downstream )
+            return "", "", 'Invalid Section', full_downstream_name, ""
+
+        if not upstream_user or not upstream_repository:
+            log( 1, "Skipping %s because the upstream is not defined...", section )
+            return downstream_user, downstream_name, 'Skipped due missing upstreams', full_downstream_name, ""
+
+        if not local_branch or not upstream_branch:
+            log.newline( count=3 )
+            log( 1, "ERROR! Invalid branches `%s`", branches )
+            return downstream_user, downstream_name, 'Invalid Section', full_downstream_name, ""
+
+        # The not completed repository does not fetch anything, `create_pull` only needs its url, and
+        # unlike `get_repo( lazy=True )`, it uses this thread requester with the ETags cache installed
+        requester = self.github_api.requester
+        fork_repo = github.Repository.Repository( requester,
+                url=f"{requester.base_url}/repos/{downstream_name}", completed=False )
 
+        self._throttle( fork_repo.requester )
+
+        try:
+            upstream_head = f"{upstream_user}:{upstream_branch}"
+
+            # The compare request does not wait for the pull requests lock, then, the sections
+            # without new commits are skipped concurrently, also on dry runs, as it is read only
+            if self._is_up_to_date( fork_repo, local_branch, upstream_head ):
+                log( 1, 'No commits between %s and %s', local_branch, upstream_head )
+                return downstream_user, downstream_name, 'No commits between', full_downstream_name, ""
+
+            if self.is_dry_run:
+                fork_pullrequest = fork_repo.url
+
+            else:
                 # avoid new rate limit:
                 # You have exceeded a secondary rate limit and have been temporarily blocked
                 # from content creation. Please retry your request again later.', 'documentation_url':
                 # 'https://docs.github.com/rest/overview/resources-in-the-rest-api#secondary-rate-limits
-                time.sleep(3)
+                with self.create_pull_lock:
+                    fork_pullrequest = fork_repo.create_pull(
+                            local_branch,
+                            upstream_head,
+                            title=f"Update from {full_upstream_name}",
+                            body=PULL_REQUEST_BODY.format( full_upstream_name ),
+                            maintainer_can_modify=False,
+                        )
+                    time.sleep(3)
 
-                # Then play with your Github objects
-                successful_resquests += 1
-                log( 1, 'Successfully Created:', fork_pullrequest )
+        except github.GithubException as error:
+            return ( downstream_user, downstream_name, *self._get_error_reason( full_downstream_name, error ) )
 
-                self.repositories_results['Successfully Created'].append( full_downstream_name )
-                if not self.is_dry_run: fork_pullrequest.add_to_labels( "backstroke" )
+        # Then play with your Github objects
+        log( 1, 'Successfully Created:', fork_pullrequest )
 
-            except github.GithubException as error:
-                self._register_error_reason( full_downstream_name, error )
-                continue
+        if not self.is_dry_run:
 
-    def _register_error_reason(self, full_downstream_name, error):
-        error = "%s, %s" % (full_downstream_name, str( error ) )
-        log( 1, 'Skipping... %s', error )
+            # The pull request was already created, then, a missing label is not a failure
+            try:
+                fork_pullrequest.add_to_labels( "backstroke" )
 
-        for reason in self.skip_reasons:
-            if reason in error:
-                self.repositories_results[reason].append(full_downstream_name)
-                break
+            except github.GithubException as error:
+                log( 1, 'Could not add the label to %s, %s', full_downstream_name, error )
+
+        return downstream_user, downstream_name, 'Successfully Created', full_downstream_name, ""
+
+    def _throttle(self, requester):
+        """
+            When the rate limit is almost over, spread the remaining requests until its reset,
+            instead of spending them all and then, waiting for the reset with the threads blocked.
+            The `requester.rate_limiting` is updated from the headers of every response it receives,
+            then, it must be the requester making the requests.
+        """
+        remaining, limit = requester.rate_limiting
+
+        if remaining < 0 or remaining >= MINIMUM_RATE_LIMIT_REMAINING:
+            return
+
+        # All threads using the same token share its remaining requests
+        threads_per_token = max( 1, self.concurrency // len( self.github_tokens ) )
+        reset_seconds = max( 0, requester.rate_limiting_resettime - time.time() )
+        delay = reset_seconds / max( 1, remaining ) * threads_per_token
+
+        # With fewer remaining requests than threads, never wait past the reset
+        delay = min( delay, reset_seconds )
+
+        log( 1, 'Only %s of %s requests remaining, waiting %.1f seconds...', remaining, limit, delay )
+        time.sleep( delay )
+
+    def _is_up_to_date(self, fork_repo, base, head):
+        """
+            Returns True if the `head` has no commits missing on the `base`. On errors, returns
+            False, then, `create_pull` reports the actual error. On dry runs, there is no `create_pull`,
+            then, the error is raised to be reported, e.g., a missing fork.
+        """
+
+        try:
+            return fork_repo.compare( base, head ).ahead_by == 0
+
+        except github.GithubException as error:
+            if self.is_dry_run: raise
+            log( 1, 'Could not compare %s...%s, %s', base, head, error )
+            return False
+
+    def _register_result(self, downstream_user, downstream_name, report_key, report_item):
+        """
+            Returns True if the pull request was created.
+        """
+
+        if downstream_name:
+            self.downstream_users.add( downstream_user )
+            self.parsed_repositories.add( downstream_name )
+
+        if report_key == 'Skipped due missing upstreams':
+            self.skipped_repositories.append( report_item )
 
         else:
-            self.repositories_results['Unknown Reason'].append(error)
+            self.repositories_results[report_key].append( report_item )
 
-    def publish_report(self):
-        log.newline()
-        index = 0
-        used_repositories = set()
-        full_used_repositories = {}
+        return report_key == 'Successfully Created'
 
-        for user in self.downstream_users:
-            fork_user = self.github_api.get_user( user )
+    def _get_error_reason(self, full_downstream_name, error):
+        """
+            Returns the `(report_key, full_downstream_name, error_details)` of the `error`.
+        """
+        status = error.status
+        messages = get_error_messages( error )
 
-            # For quick testing
-            if self.maximum_repositories and index > self.maximum_repositories: break
+        error_details = f", {error}"
+        log( 1, 'Skipping... %s%s', full_downstream_name, error_details )
 
-            for repository in fork_user.get_repos():
-                used_repositories.add( repository.full_name )
+        # The fork repository is lazy, then, `create_pull` is the first request to find it missing
+        if status == 404:
+            return 'Repository not found', full_downstream_name, ""
 
-                if self.synced_repositories:
-                    full_used_repositories[repository.full_name] = repository
-                    index += 1
+        matches = self.skip_reasons_regex.search( messages )
 
-                    # For quick testing
-                    if self.maximum_repositories and index > self.maximum_repositories: break
+        if matches:
+            return matches.group(0), full_downstream_name, ""
 
-                    log( 1, 'fetching parent %s. %s', index, repository.full_name )
-                    repository.parent
+        return 'Unknown Reason', full_downstream_name, error_details
 
+    def publish_report(self):
         log.newline()
-        log.clean('Repositories results:')
-        log.newline()
+        unparsed_repositories = []
+        listed_repositories = {}
 
-        def general_report(report_key):
-            log.newline()
-            log.clean('   ', report_key)
-            values = self.repositories_results[report_key]
+        users_repositories = get_users_repositories( self.graphql_headers, self.downstream_users )
 
-            if values:
-                index = 0
+        for repositories in users_repositories.values():
+            listed_repositories.update( ( repository['nameWithOwner'], repository ) for repository in repositories )
 
-                for item in values:
-                    index += 1
-                    log.clean('        %s. %s', index, item)
+        used_repositories = set( listed_repositories )
 
-            else:
-                log.clean('        No results.')
+        # Only the repositories without pull requests are reported as not synchronized
+        if self.synced_repositories:
+            unparsed_repositories = sorted( used_repositories - self.parsed_repositories )
 
-        index = 0
-        log.clean('    Skipped due missing upstreams:')
+            # For quick testing
+            if self.maximum_repositories: del unparsed_repositories[self.maximum_repositories:]
+
+        # Log the whole report at once, instead of one log call per item
+        report = ['Repositories results:', '', '    Skipped due missing upstreams:']
+        report.extend( f'        {index}. {item}' for index, item in enumerate( self.skipped_repositories, start=1 ) )
 
-        for skipped_repository in self.skipped_repositories:
-            index += 1
-            log.clean('        %s. %s', index, skipped_repository)
+        def general_report(report_key, values):
+            report.append( '' )
+            report.append( f'    {report_key}' )
+
+            if values:
+                report.extend( f'        {index}. {item}' for index, item in enumerate( values, start=1 ) )
+
+            else:
+                report.append( '        No results.' )
 
         report_first = 'No commits between'
-        general_report(report_first)
-        del self.repositories_results[report_first]
+        general_report( report_first, self.repositories_results[report_first] )
 
         if self.synced_repositories:
-            index = 0
-            log.newline()
-            log.clean('    Repositories not Synchronized with Pull Requests:')
+            # The repositories listing already has their parents, then, nothing else is fetched
+            general_report( 'Repositories not Synchronized with Pull Requests:', [
+                    f'{repository["nameWithOwner"]}@{get_default_branch( repository )}, '
+                    f'upstream -> {repository["parent"]["nameWithOwner"]}@{get_default_branch( repository["parent"] )}'
+                    for repository in map( listed_repositories.get, unparsed_repositories ) if repository['parent']
+                ] )
+
+        renamed_repositories = []
 
-            for repository_name in used_repositories:
-                repository = full_used_repositories[repository_name]
+        for repository_name in sorted( self.parsed_repositories - used_repositories ):
 
-                if repository.parent:
+            # GitHub redirects the renamed repositories to their new name
+            try:
+                full_repository = self.github_api.get_repo( repository_name )
+
+            except github.GithubException as error:
+                log( 1, 'Skipping... %s, %s', repository_name, error )
+                continue
 
-                    if repository_name not in self.parsed_repositories:
-                        index += 1
-                        parent = repository.parent
-                        log.clean( '        %s. %s@%s, upstream -> %s@%s', index, repository_name, repository.default_branch,
-                                parent.full_name, parent.default_branch )
+            if full_repository.full_name != repository_name:
+                renamed_repositories.append( f'{repository_name}, actual name -> {full_repository.full_name}' )
+
+        general_report( 'Possible Renamed Repositories:', renamed_repositories )
 
-            if index == 0:
-                log.clean('        No results.')
+        for report_key, values in self.repositories_results.items():
+            if report_key != report_first: general_report( report_key, values )
 
         log.newline()
-        log.clean('    Possible Renamed Repositories:')
+        log.clean( "\n".join( report ) )
+        self.etags_cache.save()
+
+
+class ETagsCache(object):
+    """
+        Replay the GET responses saved on the last runs with their ETags, because the GitHub
+        conditional requests answered by `304 Not Modified` do not count against the rate limit.
+        https://docs.github.com/en/rest/using-the-rest-api/best-practices-for-using-the-rest-api
+    """
 
-        index = 0
-        renamed_repositories = self.parsed_repositories - used_repositories
+    def __init__(self, cache_file=ETAGS_CACHE_FILE):
+        self.cache_file = cache_file
+        self.cache_lock = threading.Lock()
 
-        for repository_name in renamed_repositories:
-            full_repository = self.full_parsed_repositories[repository_name]
+        self.responses = load_data_file( cache_file )
 
-            if full_repository.full_name != repository_name:
-                index += 1
-                log.clean( '        %s. %s, actual name -> %s', index, repository_name, full_repository.full_name )
+    def install(self, requester):
+        """
+            Wrap the `requestJson` of a PyGithub `Requester`, which is used by all its JSON requests.
+        """
+        request_json = requester.requestJson
+
+        def cached_request_json(verb, url, parameters=None, headers=None, *args, **kwargs):
+            if verb != "GET":
+                return request_json( verb, url, parameters, headers, *args, **kwargs )
+
+            cache_key = "%s %s" % ( url, json.dumps( parameters, sort_keys=True ) )
+            cached_response = self.responses.get( cache_key )
+
+            if cached_response:
+                headers = dict( headers or {} )
+                headers["If-None-Match"] = cached_response[0]
+
+            status, response_headers, output = request_json( verb, url, parameters, headers, *args, **kwargs )
+
+            if status == 304 and cached_response:
+                status, output = 200, cached_response[1]
+
+            # The compare responses can have several megabytes of commits and patches, then, the
+            # big responses are not saved, as the whole cache is loaded and written on every run
+            if status == 200 and "etag" in response_headers:
+                with self.cache_lock:
+                    self.responses.pop( cache_key, None )
+
+                    if len( output or "" ) <= MAXIMUM_ETAGS_RESPONSE_SIZE:
+                        self.responses[cache_key] = [response_headers["etag"], output]
+
+            return status, response_headers, output
+
+        requester.requestJson = cached_request_json
+
+    def save(self):
+
+        with self.cache_lock:
+
+            while len( self.responses ) > MAXIMUM_ETAGS_ENTRIES:
+                self.responses.popitem( last=False )
+
+            save_data_file( self.cache_file, self.responses )
+
+
+def raise_on_redirects(requester):
+    """
+        PyGithub only raises on the status 400 and above, then, a redirect answered to a request
+        other than GET is parsed as its object, e.g., a pull request on a renamed fork answered by
+        `307 Temporary Redirect` becomes a `PullRequest(number=None)`.
+    """
+    request_json = requester.requestJson
+
+    def checked_request_json(verb, url, *args, **kwargs):
+        status, response_headers, output = request_json( verb, url, *args, **kwargs )
+
+        if verb != "GET" and 300 <= status < 400:
+            raise github.GithubException( status,
+                    {'message': f"Moved to {response_headers.get( 'location' )}"}, response_headers )
+
+        return status, response_headers, output
 
-        if index == 0: log.clean('        No results.')
+    requester.requestJson = checked_request_json
 
-        for report_key in self.repositories_results.keys():
-            general_report(report_key)
+
+def get_error_messages(error):
+    """
+        Join the messages of the JSON response parsed on the `github.GithubException.data`, e.g.,
+        {"message": "Validation Failed", "errors": [{"message": "No commits between master and develop"}]}
+    """
+    data = error.data if isinstance( error.data, dict ) else {}
+    messages = [ data.get( 'message' ) or "" ]
+
+    for item in data.get( 'errors' ) or []:
+        messages.append( ( item.get( 'message' ) or "" ) if isinstance( item, dict ) else str( item ) )
+
+    return "\n".join( messages )
+
+
+def load_data_file(file_path):
+    try:
+        with open( file_path, 'r' ) as data_file:
+            return json.load( data_file, object_pairs_hook=OrderedDict )
+
+    except( IOError, ValueError ):
+        return OrderedDict()
+
+
+def save_data_file(file_path, data, **kwargs):
+    """
+        Write the JSON to a temporary file, then, replace the old file with it. A process killed
+        while writing leaves the old file intact, instead of a truncated one.
+    """
+    temporary_file = f"{file_path}.tmp"
+
+    with open( temporary_file, 'w', buffering=WRITE_BUFFER_SIZE ) as output_file:
+        json.dump( data, output_file, **kwargs )
+
+    os.replace( temporary_file, file_path )
+
+
+def read_github_token(github_token):
+    """
+        The token is either the token itself or a file with it, then, the file is read only once
+        without checking it exists first, and up to a token size.
+    """
+    github_token = github_token.strip()
+
+    try:
+        with open( github_token, 'r' ) as input_file:
+            github_token = input_file.read( MAXIMUM_TOKEN_FILE_SIZE )
+
+    except ( OSError, ValueError ):
+        pass
+
+    return github_token.strip()
+
+
+def read_without_tabs(file_path):
+    """
+        Stream the file lines without the tabs, instead of loading the whole file into memory.
+        https://stackoverflow.com/questions/45415684/how-to-stop-tabs-on-python-2-7-rawconfigparser-throwing-parsingerror/
+    """
+    with open( file_path, 'r', buffering=READ_BUFFER_SIZE, encoding='utf-8' ) as input_file:
+
+        for line in input_file:
+            yield line.replace( '\t', '' )
+
+
+def get_section_key(url, upstream, branches):
+    """
+        The sections with the same downstream, upstream and branches create the same pull request.
+        The GitHub names are case insensitive. Incomplete sections have some empty key item.
+    """
+    return ( *parse_github( url.lower() ), *parse_github( upstream.lower() ), *parser_branches( branches ) )
 
 
 def parser_branches(branches):
-    matches = re.search( r'(.+)\-\>(.+),', branches )
+    matches = BRANCHES_REGEX.search( branches )
 
     if matches:
         return matches.group(2), matches.group(1)
@@ -500,13 +864,11 @@ def parser_branches(branches):
 
 
 def parse_github(url):
-    matches = re.search( r'github\.com\/(.+)\/(.+)', url )
+    matches = GITHUB_URL_REGEX.search( url )
 
     if matches:
         user = matches.group(1)
         repository = matches.group(2)
-
-        if repository.endswith('.git'): repository = repository[:-4]
         return user, repository
 
     return "", ""
@@ -520,11 +882,76 @@ def lock_context_manager():
         https://stackoverflow.com/questions/10447818/python-context-manager-conditionally-executing-body
         https://stackoverflow.com/questions/34775099/why-does-contextmanager-throws-a-runtime-error-generator-didnt-stop-after-thro
     """
+    lock_file = acquire_file_lock()
+    is_allowed = lock_file is not None and is_allowed_to_run()
+
     try:
-        yield is_allowed_to_run()
+        yield is_allowed
 
     finally:
-        free_mutex_lock()
+        # Only the caller holding the lock can free it, otherwise, a refused call would stop the running one
+        if is_allowed: free_mutex_lock()
+        release_file_lock( lock_file )
+
+
+def acquire_file_lock():
+    """
+        Lock the `LOCK_FILE` without blocking, then, two processes cannot write the same
+        `last_session.json` at once. Returns `None` when another process holds the lock.
+    """
+    lock_file = open( LOCK_FILE, 'a' )
+
+    try:
+        if fcntl:
+            fcntl.flock( lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB )
+
+        else:
+            lock_file.seek( 0 )
+            msvcrt.locking( lock_file.fileno(), msvcrt.LK_NBLCK, 1 )
+
+    except OSError:
+        lock_file.close()
+        log( 1, "Another command is already running, the file `%s` is locked", LOCK_FILE )
+        return None
+
+    return lock_file
+
+
+def release_file_lock(lock_file):
+    if lock_file is None: return
+
+    try:
+        if fcntl:
+            fcntl.flock( lock_file, fcntl.LOCK_UN )
+
+        else:
+            lock_file.seek( 0 )
+            msvcrt.locking( lock_file.fileno(), msvcrt.LK_UNLCK, 1 )
+
+    finally:
+        lock_file.close()
+
+
+@contextlib.contextmanager
+def exit_on_sigterm():
+    """
+        Raise `SystemExit` on SIGTERM, then, the session is saved before the process exits as for
+        any other exception. The signal handlers can only be installed on the main thread.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def sigterm_handler(signum, frame):
+        raise SystemExit( f"Stopping the process due the signal {signum}" )
+
+    old_handler = signal.signal( signal.SIGTERM, sigterm_handler )
+
+    try:
+        yield
+
+    finally:
+        signal.signal( signal.SIGTERM, old_handler )
 
 
 def free_mutex_lock():
@@ -543,41 +970,49 @@ def is_allowed_to_run():
     return True
 
 
+# The GraphQL templates are wrapped once, then, each repository only formats them
+enable_issues_graphql = wrap_text( """
+    update%05d: updateRepository(input:{repositoryId:"%s", hasIssuesEnabled:true}) {
+      repository {
+         nameWithOwner
+      }
+    }
+""" )
+
+add_star_graphql = wrap_text( """
+    update%05d: addStar(input:{starrableId:"%s"}) {
+      clientMutationId
+      starrable {
+        viewerHasStarred
+      }
+    }
+""" )
+
+watch_repository_graphql = wrap_text( """
+    update%05d: updateSubscription(input:{subscribableId:"%s", state:SUBSCRIBED}) {
+      clientMutationId
+      subscribable {
+        viewerSubscription
+      }
+    }
+""" )
+
+
 def enable_github_issue_tracker(username):
     def graphql(index, repository_id):
-        return wrap_text( """
-            update%05d: updateRepository(input:{repositoryId:"%s", hasIssuesEnabled:true}) {
-              repository {
-                 nameWithOwner
-              }
-            }
-        """ % ( index, repository_id ) )
+        return enable_issues_graphql % ( index, repository_id )
     run_action_on_all_repositories(username, graphql)
 
 
 def add_stars_on_github_repositories(username):
     def graphql(index, repository_id):
-        return wrap_text( """
-            update%05d: addStar(input:{starrableId:"%s"}) {
-              clientMutationId
-              starrable {
-                viewerHasStarred
-              }
-            }
-        """ % ( index, repository_id ) )
+        return add_star_graphql % ( index, repository_id )
     run_action_on_all_repositories(username, graphql)
 
 
 def watch_all_github_repositories(username):
     def graphql(index, repository_id):
-        return wrap_text( """
-            update%05d: updateSubscription(input:{subscribableId:"%s", state:SUBSCRIBED}) {
-              clientMutationId
-              subscribable {
-                viewerSubscription
-              }
-            }
-        """ % ( index, repository_id ) )
+        return watch_repository_graphql % ( index, repository_id )
     run_action_on_all_repositories(username, graphql)
 
 
@@ -590,54 +1025,65 @@ def run_action_on_all_repositories(username, action):
         "items": 100,
     }
 
-    while True:
-        repositories = get_all_user_repositories(queryvariables)
+    repositories = get_all_user_repositories(queryvariables)
 
-        # log('repositories', repositories)
-        _run_graphql_action(repositories, action)
+    # Fetch the next page while the current one is updated, then, the pause between the updates
+    # also covers the next page request
+    with concurrent.futures.ThreadPoolExecutor( max_workers=1 ) as executor:
 
-        if not queryvariables['hasNextPage']: break
-        time.sleep(3)
+        while True:
+            next_repositories = None
+
+            if queryvariables['hasNextPage']:
+                next_repositories = executor.submit( get_all_user_repositories, queryvariables )
+
+            # log('repositories', repositories)
+            _run_graphql_action(repositories, action)
+            updated_time = time.time()
+
+            if not next_repositories: break
+            repositories = next_repositories.result()
+            time.sleep( max( 0, 3 - ( time.time() - updated_time ) ) )
+
+
+update_repositories_graphql = wrap_text( """
+    mutation UpdateUserRepositories {
+      %s
+    }
+""" )
 
 
 def _run_graphql_action(repositories, action):
-    graphqlquery = ""
+    graphqlquery = "\n".join( action( index, repository_id )
+            for index, ( _, repository_id ) in enumerate( repositories, start=1 ) )
 
-    for index, repository in enumerate(repositories, start=1):
-        repository_id = repository[1]
-        graphqlquery += action(index, repository_id) + "\n"
+    graphqlresults = run_graphql_query( headers, update_repositories_graphql % graphqlquery )
+    log('graphqlresults', graphqlresults)
 
-    graphqlresults = run_graphql_query( headers, wrap_text( """
-        mutation UpdateUserRepositories {
-          %s
+
+list_user_repositories_graphql = wrap_text( """
+    query ListUserRepositories($user: String!, $items: Int!, $lastItem: String) {
+      repositoryOwner(login: $user) {
+        repositories(first: $items, after: $lastItem, orderBy: {field: STARGAZERS, direction: DESC}, ownerAffiliations: [OWNER]) {
+          pageInfo {
+            hasNextPage
+            endCursor
+          }
+          nodes {
+            name
+            id
+            isArchived
+          }
         }
-        """ % graphqlquery )
-    )
-    log('graphqlresults', graphqlresults)
+      }
+    }
+""" )
 
 
 def get_all_user_repositories(queryvariables):
     repositories_found = []
 
-    graphqlquery = wrap_text( """
-        query ListUserRepositories($user: String!, $items: Int!, $lastItem: String) {
-          repositoryOwner(login: $user) {
-            repositories(first: $items, after: $lastItem, orderBy: {field: STARGAZERS, direction: DESC}, ownerAffiliations: [OWNER]) {
-              pageInfo {
-                hasNextPage
-                endCursor
-              }
-              nodes {
-                name
-                id
-                isArchived
-              }
-            }
-          }
-        }
-    """ )
-
-    graphqlresults = run_graphql_query( headers, graphqlquery, queryvariables )
+    graphqlresults = run_graphql_query( headers, list_user_repositories_graphql, queryvariables )
     pageInfo = graphqlresults["data"]["repositoryOwner"]["repositories"]["pageInfo"]
 
     nodes = graphqlresults["data"]["repositoryOwner"]["repositories"]["nodes"]
@@ -651,6 +1097,78 @@ def get_all_user_repositories(queryvariables):
     return repositories_found
 
 
+repository_owner_graphql = wrap_text( """
+    user%05d: repositoryOwner(login: %s) {
+      repositories(first: 100, after: %s, ownerAffiliations: [OWNER]) {
+        pageInfo {
+          hasNextPage
+          endCursor
+        }
+        nodes {
+          nameWithOwner
+          defaultBranchRef {
+            name
+          }
+          parent {
+            nameWithOwner
+            defaultBranchRef {
+              name
+            }
+          }
+        }
+      }
+    }
+""" )
+
+list_users_repositories_graphql = wrap_text( """
+    query ListUsersRepositories {
+      %s
+    }
+""" )
+
+
+def get_users_repositories(headers, users, users_per_query=20):
+    """ Returns a dictionary with the repositories owned by each user, with their full name, default
+    branch and parent. Instead of one REST request per user page and per parent, each query lists
+    up to `users_per_query` users with aliases """
+    users_repositories = { user: [] for user in users }
+    users_cursors = dict.fromkeys( users )
+
+    while users_cursors:
+        users_batch = list( users_cursors.items() )[:users_per_query]
+        graphqlquery = []
+
+        for index, ( user, cursor ) in enumerate( users_batch ):
+            graphqlquery.append( repository_owner_graphql % ( index, json.dumps( user ), json.dumps( cursor ) ) )
+
+        graphqlresults = run_graphql_query( headers, list_users_repositories_graphql % "\n".join( graphqlquery ) )
+
+        for index, ( user, cursor ) in enumerate( users_batch ):
+            repository_owner = graphqlresults["data"]["user%05d" % index]
+
+            # The user or organization does not exist anymore
+            if not repository_owner:
+                del users_cursors[user]
+                continue
+
+            repositories = repository_owner["repositories"]
+            users_repositories[user].extend( repositories["nodes"] )
+
+            if repositories["pageInfo"]["hasNextPage"]:
+                users_cursors[user] = repositories["pageInfo"]["endCursor"]
+
+            else:
+                del users_cursors[user]
+
+    return users_repositories
+
+
+def get_default_branch(repository):
+    """ The empty repositories do not have a `defaultBranchRef` """
+    default_branch = repository['defaultBranchRef']
+    return default_branch['name'] if default_branch else None
+
+
 github_ratelimit_graphql = wrap_text( """
     rateLimit {
         limit
@@ -682,7 +1200,7 @@ def run_graphql_query(headers, graphqlquery, queryvariables={}, graphql_url="htt
     """ headers { "Authorization": f"Bearer {github_token}" } """
     # https://github.com/evandrocoan/GithubRepositoryResearcher
     # https://gist.github.com/gbaman/b3137e18c739e0cf98539bf4ec4366ad
-    request = requests.post( graphql_url, json={'query': graphqlquery, 'variables': queryvariables}, headers=headers )
+    request = graphql_session.post( graphql_url, json={'query': graphqlquery, 'variables': queryvariables}, headers=headers )
     fix_line = lambda line: str(line).replace('\\n', '\n')
 
     if request.status_code == 200: